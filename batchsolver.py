@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+""" Propagation of many CSP-problems with the same constraints at once, with numpy.
+
+All sudokus of the same size have the same constraints, only their givens differ. Instead of solving them one at a
+time, the domains of N problems are put in one boolean array of shape (N, variables, values), and peer elimination
+and hidden singles are done with a few array operations for all problems together. Only the problems that are not
+solved by that are solved one by one with a backtracking solver.
+
+numpy is only needed for this module, the rest of the solvers work without it.
+"""
+import numpy
+
+from constraintproblem import Problem
+
+
+class BatchSolver(object):
+    """ propagates the domains of a batch of problems that share a Topology.
+
+    example:
+        solver = BatchSolver(sudoku_topology(), variables, range(1, 10))
+        candidates = solver.from_givens(givens)
+        solutions, propagated = solver.solve(candidates, options)
+    """
+
+    def __init__(self, topology, variables, values):
+        """
+        @param topology: the constraints shared by all problems
+        @type topology: instance of Topology
+        @param variables: the variables of the problems, in the order of the second axis of the candidates
+        @type variables: a list
+        @param values: all values of the domains, in the order of the third axis of the candidates
+        @type values: a list
+        """
+        self.topology = topology
+        self.variables = list(variables)
+        self.values = list(values)
+        index = dict((variable, i) for i, variable in enumerate(self.variables))
+
+        # peers[i, j] is 1 if variable j is a peer of variable i
+        self.peers = numpy.zeros((len(self.variables), len(self.variables)), dtype=numpy.float32)
+        for variable, peers in topology.peers.iteritems():
+            for peer in peers:
+                self.peers[index[variable], index[peer]] = 1
+        # units[u, i] is 1 if variable i is in unit u, only units that must contain every value
+        units = [unit for unit in topology.units if len(unit) == len(self.values)]
+        self.units = numpy.zeros((len(units), len(self.variables)), dtype=numpy.float32)
+        for u, unit in enumerate(units):
+            for variable in unit:
+                self.units[u, index[variable]] = 1
+
+    def candidates(self, domains):
+        """ returns the boolean candidate array of shape (N, variables, values) for a list of N dictionaries that
+            map the variables to their domains.
+        """
+        candidates = numpy.zeros((len(domains), len(self.variables), len(self.values)), dtype=bool)
+        value_index = dict((value, k) for k, value in enumerate(self.values))
+        for n, problem_domains in enumerate(domains):
+            for i, variable in enumerate(self.variables):
+                for value in problem_domains[variable]:
+                    candidates[n, i, value_index[value]] = True
+        return candidates
+
+    def from_givens(self, givens, empty=0):
+        """ returns the boolean candidate array for an array of shape (N, variables) with the value of every
+            variable, where empty means that the variable can still have all values (like the 0s of a sudoku).
+        """
+        givens = numpy.asarray(givens)
+        values = numpy.asarray(self.values)
+        return (givens[:, :, numpy.newaxis] == values) | (givens == empty)[:, :, numpy.newaxis]
+
+    def eliminate(self, candidates):
+        """ peer elimination for all problems: the value of every assigned variable is removed from its peers """
+        n, nvars, nvalues = candidates.shape
+        assigned = candidates & (candidates.sum(axis=2) == 1)[:, :, numpy.newaxis]
+        # blocked[n, i, k] > 0 if a peer of variable i is assigned value k
+        blocked = numpy.dot(self.peers, assigned.transpose(1, 0, 2).reshape(nvars, n * nvalues).astype(numpy.float32))
+        blocked = blocked.reshape(nvars, n, nvalues).transpose(1, 0, 2) > 0
+        return candidates & ~(blocked & ~assigned)
+
+    def hidden_singles(self, candidates):
+        """ a value that fits in only one variable of a unit is assigned to that variable """
+        n, nvars, nvalues = candidates.shape
+        flat = candidates.transpose(1, 0, 2).reshape(nvars, n * nvalues).astype(numpy.float32)
+        # counts[u, n, k]: number of variables in unit u of problem n where value k fits
+        counts = numpy.dot(self.units, flat)
+        single = (counts == 1).astype(numpy.float32)
+        # hidden[n, i, k]: value k fits only in variable i in one of the units of i
+        hidden = numpy.dot(self.units.T, single).reshape(nvars, n, nvalues).transpose(1, 0, 2) > 0
+        hidden &= candidates
+        has_hidden = hidden.any(axis=2)[:, :, numpy.newaxis]
+        return numpy.where(has_hidden, hidden, candidates)
+
+    def contradictions(self, candidates):
+        """ returns a boolean array of shape (N,) that is True for problems that have no solution anymore """
+        n, nvars, nvalues = candidates.shape
+        sizes = candidates.sum(axis=2)
+        # a variable without values
+        wrong = (sizes == 0).any(axis=1)
+        # a value that fits nowhere in a unit, or is assigned twice in a unit
+        flat = candidates.transpose(1, 0, 2).reshape(nvars, n * nvalues).astype(numpy.float32)
+        counts = numpy.dot(self.units, flat).reshape(-1, n, nvalues)
+        wrong |= (counts == 0).any(axis=2).any(axis=0)
+        assigned = candidates & (sizes == 1)[:, :, numpy.newaxis]
+        flat = assigned.transpose(1, 0, 2).reshape(nvars, n * nvalues).astype(numpy.float32)
+        counts = numpy.dot(self.units, flat).reshape(-1, n, nvalues)
+        wrong |= (counts > 1).any(axis=2).any(axis=0)
+        return wrong
+
+    def propagate(self, candidates):
+        """ runs peer elimination and hidden singles on all problems until nothing changes anymore.
+            returns the new candidates.
+        """
+        candidates = candidates.copy()
+        # only the problems that still changed in the last round are propagated again
+        active = numpy.arange(candidates.shape[0])
+        while active.size:
+            old = candidates[active]
+            new = self.hidden_singles(self.eliminate(old))
+            candidates[active] = new
+            active = active[(new != old).reshape(active.size, -1).any(axis=1)]
+        return candidates
+
+    def solve(self, candidates, options):
+        """ propagates all problems at once and solves the problems that are not solved by that one by one.
+
+            @param options: keyword arguments for the Problem of the problems that are solved one by one
+            @type options: dict
+            @return: a list with for every problem the solution of the form {variable: [value]}, or False if it has
+                     no solution, and the number of problems that were solved by the propagation only
+        """
+        candidates = self.propagate(candidates)
+        wrong = self.contradictions(candidates)
+        solved = ~wrong & (candidates.sum(axis=2) == 1).all(axis=1)
+
+        solutions = []
+        for n in xrange(candidates.shape[0]):
+            domains = dict((variable, [self.values[k] for k in numpy.flatnonzero(candidates[n, i])])
+                           for i, variable in enumerate(self.variables))
+            if wrong[n]:
+                solutions.append(False)
+            elif solved[n]:
+                solutions.append(domains)
+            else:
+                problem = Problem(topology=self.topology, **options)
+                for variable, domain in domains.iteritems():
+                    problem.addVariable(variable, domain)
+                solution, statistics = problem.getSolution()
+                solutions.append(solution)
+        return solutions, int(solved.sum())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+""" Exact cover solver for CSP-problems of constraintproblem, with Dancing Links (Algorithm X).
+
+A sudoku is an exact cover problem: every cell gets exactly one value, and every value is exactly once in every
+row, column and box. Each possible assignment (cell, value) is a row of a 0/1 matrix, each of these conditions is a
+column, and a solution is a set of rows with exactly one 1 in every column.
+
+the nodes of the matrix are not objects, but indexes in a few lists (left, right, up, down, column, row), this is
+faster and uses much less memory than a linked structure of objects.
+"""
+from constraintproblem import Solver
+
+
+class DLXSolver(Solver):
+    """ solver that rewrites the problem to an exact cover problem and solves it with Dancing Links.
+
+    it works for problems where all constraints are AllDifferentConstraints, like a sudoku. a constraint over as many
+    variables as there are values is a primary column per value (the value must be used exactly once), smaller
+    constraints are secondary columns (the value may be used at most once).
+
+    the solution and the statistics have the same form as the other solvers:
+        splits: rows chosen for a column that had more than one row left, i.e. real choices
+        backtracks: such columns of which all rows failed
+
+    example:
+        problem = Problem(topology=sudoku_topology(), solver=DLXSolver())
+    """
+
+    def getSolution(self, problem):
+        self.build(problem)
+        solution = []
+        if not self.select_givens(problem, solution):
+            return False
+        if not self.search(problem, solution):
+            return False
+
+        problem.variables = {}
+        for row in solution:
+            variable, value = self.rows[row]
+            problem.variables[variable] = [value]
+        return problem.variables
+
+    def build(self, problem):
+        """ makes the exact cover matrix for the problem """
+        values = sorted(set(value for domain in problem.variables.values() for value in domain))
+        topology = problem.getTopology()
+
+        # node 0 is the root, nodes 1..n the column headers, the rest are the 1s of the matrix
+        self.L = [0]
+        self.R = [0]
+        self.U = [0]
+        self.D = [0]
+        self.C = [0]
+        self.ROW = [-1]
+        self.S = [0]
+
+        # columns: one per variable, and one per constraint and value
+        columns = {}
+        for variable in problem.variables:
+            columns[variable] = self.add_column(True)
+        for unit in topology.units:
+            primary = len(unit) == len(values)
+            for value in values:
+                columns[unit, value] = self.add_column(primary)
+        units = dict((variable, []) for variable in problem.variables)
+        for unit in topology.units:
+            for variable in unit:
+                units[variable].append(unit)
+
+        # rows: one per variable and value in its domain
+        self.rows = []
+        self.row_nodes = []
+        for variable, domain in problem.variables.iteritems():
+            for value in domain:
+                row_columns = [columns[variable]] + [columns[unit, value] for unit in units[variable]]
+                self.row_nodes.append(self.add_row(len(self.rows), row_columns))
+                self.rows.append((variable, value))
+
+    def add_column(self, primary):
+        L, R = self.L, self.R
+        c = len(L)
+        if primary:
+            # insert before the root, at the end of the list of columns
+            L.append(L[0])
+            R.append(0)
+            R[L[0]] = c
+            L[0] = c
+        else:
+            # secondary columns are not in the list of columns, they don't have to be covered
+            L.append(c)
+            R.append(c)
+        self.U.append(c)
+        self.D.append(c)
+        self.C.append(c)
+        self.ROW.append(-1)
+        self.S.append(0)
+        return c
+
+    def add_row(self, row, row_columns):
+        """ adds a row with a 1 in each of row_columns, returns its first node """
+        L, R, U, D = self.L, self.R, self.U, self.D
+        first = len(L)
+        for i, c in enumerate(row_columns):
+            node = first + i
+            # left and right within the row, circular
+            L.append(node - 1 if i else first + len(row_columns) - 1)
+            R.append(node + 1 if i < len(row_columns) - 1 else first)
+            # up and down within the column, insert at the bottom
+            U.append(U[c])
+            D.append(c)
+            D[U[c]] = node
+            U[c] = node
+            self.C.append(c)
+            self.ROW.append(row)
+            self.S[c] += 1
+        return first
+
+    def cover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        L[R[c]] = L[c]
+        R[L[c]] = R[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                U[D[j]] = U[j]
+                D[U[j]] = D[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                U[D[j]] = j
+                D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        L[R[c]] = c
+        R[L[c]] = c
+
+    def select_givens(self, problem, solution):
+        """ puts the rows of variables with a single value in the solution before the search.
+            returns False if two of these rows have a column in common.
+        """
+        covered = set()
+        for row, (variable, value) in enumerate(self.rows):
+            if len(problem.variables[variable]) != 1:
+                continue
+            node = self.row_nodes[row]
+            row_columns = [self.C[node]]
+            j = self.R[node]
+            while j != node:
+                row_columns.append(self.C[j])
+                j = self.R[j]
+            if covered.intersection(row_columns):
+                return False
+            for c in row_columns:
+                self.cover(c)
+            covered.update(row_columns)
+            solution.append(row)
+        return True
+
+    def search(self, problem, solution):
+        L, R, D, C, S = self.L, self.R, self.D, self.C, self.S
+        if R[0] == 0:
+            # all primary columns are covered
+            return True
+
+        # column with the fewest rows left
+        c = R[0]
+        size = S[c]
+        j = R[c]
+        while j != 0 and size > 1:
+            if S[j] < size:
+                c = j
+                size = S[j]
+            j = R[j]
+        if size == 0:
+            return False
+
+        self.cover(c)
+        r = D[c]
+        while r != c:
+            solution.append(self.ROW[r])
+            j = R[r]
+            while j != r:
+                self.cover(C[j])
+                j = R[j]
+            if size > 1:
+                problem.splits += 1
+            if self.search(problem, solution):
+                return True
+            j = L[r]
+            while j != r:
+                self.uncover(C[j])
+                j = L[j]
+            solution.pop()
+            r = D[r]
+        self.uncover(c)
+        if size > 1:
+            problem.backtracks += 1
+        return False
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+#
+# Compare solvers and solver options on some of the example problems.
+# For every run the time, the number of constraint checks (calls of
+# the constraint functions), the number of nodes (assignments tried)
+# per second and the values pruned by filtering constraints are shown.
+#
+from constraint import *
+import random
+import time
+import sys
+import os
+
+class Counter(object):
+    def __init__(self):
+        self.checks = 0
+        self.nodes = 0
+        # Constraints with a pruned attribute
+        self.filters = []
+
+class NodeCounter(Constraint):
+    # Constraint over all variables, which is checked first whenever a
+    # variable gets a value. It counts the nodes and accepts everything.
+    def __init__(self, counter):
+        self._counter = counter
+
+    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        self._counter.nodes += 1
+        return True
+
+def newproblem(counter):
+    problem = Problem()
+    problem.addConstraint(NodeCounter(counter))
+    return problem
+
+def queens(size, counter, table=False):
+    problem = newproblem(counter)
+    cols = range(size)
+    rows = range(size)
+    problem.addVariables(cols, rows)
+    for col1 in cols:
+        for col2 in cols:
+            if col1 < col2:
+                def func(row1, row2, col1=col1, col2=col2):
+                    counter.checks += 1
+                    return abs(row1-row2) != abs(col1-col2) and row1 != row2
+                if table:
+                    func = TableConstraint(func=func)
+                problem.addConstraint(func, (col1, col2))
+    return problem
+
+def coloring(size, colors, counter):
+    # Color a grid where every cell differs from its row, column and
+    # diagonal neighbours.
+    problem = newproblem(counter)
+    cells = [(row, col) for row in range(size) for col in range(size)]
+    problem.addVariables(cells, range(colors))
+    def func(color1, color2):
+        counter.checks += 1
+        return color1 != color2
+    for row, col in cells:
+        for other in ((row, col+1), (row+1, col-1), (row+1, col),
+                      (row+1, col+1)):
+            if other in cells:
+                problem.addConstraint(func, ((row, col), other))
+    return problem
+
+def alldifferent(size, domain, counter):
+    # Permutations, with large domains.
+    problem = newproblem(counter)
+    problem.addVariables(range(size), domain(range(size)))
+    problem.addConstraint(AllDifferentConstraint())
+    return problem
+
+def crosswords(mask, words, counter):
+    # Fill a mask of the crosswords example with the given number of
+    # words for every slot. No word list comes with the examples, so
+    # the words are made of random letters, with a fixed seed.
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "crosswords", mask)
+    lines = open(path).read().rstrip().splitlines()
+    cells = set([(row, col) for row, line in enumerate(lines)
+                 for col, char in enumerate(line) if not char.isspace()])
+    # Horizontal and vertical runs of more than 3 cells, as in the
+    # example.
+    slots = []
+    for drow, dcol in ((0, 1), (1, 0)):
+        for row, col in sorted(cells):
+            if (row-drow, col-dcol) in cells:
+                continue
+            slot = []
+            while (row, col) in cells:
+                slot.append((row, col))
+                row, col = row+drow, col+dcol
+            if len(slot) > 3:
+                slots.append(slot)
+    problem = newproblem(counter)
+    rand = random.Random(0)
+    letters = "EEEEETTTAAAOOIINNSSHHRRDLLCUMWFGYPB"
+    for i, slot in enumerate(slots):
+        problem.addVariable(i, ["".join([rand.choice(letters)
+                                         for cell in slot])
+                                for j in range(words)])
+    for i, slot1 in enumerate(slots):
+        for j, slot2 in enumerate(slots):
+            if i < j:
+                for cell in set(slot1) & set(slot2):
+                    def func(word1, word2, index1=slot1.index(cell),
+                             index2=slot2.index(cell)):
+                        counter.checks += 1
+                        return word1[index1] == word2[index2]
+                    problem.addConstraint(func, (i, j))
+    problem.addConstraint(AllDifferentConstraint())
+    return problem
+
+# Arto Inkala's "world's hardest sudoku"
+SUDOKU = ("800000000003600000070090000050007000000045700"
+          "000100030001000068008500010090000400")
+
+def sudoku(filtering, counter):
+    problem = newproblem(counter)
+    cells = [(row, col) for row in range(9) for col in range(9)]
+    for (row, col), given in zip(cells, SUDOKU):
+        if given == "0":
+            problem.addVariable((row, col), range(1, 10))
+        else:
+            problem.addVariable((row, col), [int(given)])
+    units = [[(row, col) for col in range(9)] for row in range(9)]
+    units += [[(row, col) for row in range(9)] for col in range(9)]
+    units += [[(row+i, col+j) for i in range(3) for j in range(3)]
+              for row in (0, 3, 6) for col in (0, 3, 6)]
+    for unit in units:
+        constraint = AllDifferentConstraint(filtering)
+        if filtering:
+            counter.filters.append(constraint)
+        problem.addConstraint(constraint, unit)
+    return problem
+
+# (name, function making the problem, find all solutions)
+PROBLEMS = [("queens 8, all solutions", lambda c: queens(8, c), True),
+            ("queens 8 with tables, all solutions",
+             lambda c: queens(8, c, True), True),
+            ("queens 25, one solution", lambda c: queens(25, c), False),
+            ("queens 25 with tables, one solution",
+             lambda c: queens(25, c, True), False),
+            ("queens 60, one solution", lambda c: queens(60, c), False),
+            ("coloring 6x6, one solution", lambda c: coloring(6, 4, c), False),
+            ("coloring 15x15, one solution",
+             lambda c: coloring(15, 4, c), False),
+            ("crosswords large, one solution",
+             lambda c: crosswords("large.mask", 200, c), False),
+            ("crosswords large with 50 words, no solution",
+             lambda c: crosswords("large.mask", 50, c), False),
+            ("alldifferent 200, one solution",
+             lambda c: alldifferent(200, Domain, c), False),
+            ("alldifferent 200 with sparse domains, one solution",
+             lambda c: alldifferent(200, SparseDomain, c), False),
+            ("sudoku", lambda c: sudoku(None, c), False),
+            ("sudoku, bounds filtering", lambda c: sudoku("bounds", c), False),
+            ("sudoku, matching filtering",
+             lambda c: sudoku("matching", c), False)]
+
+# (name, function making the solver)
+SOLVERS = [("forward checking", lambda: BacktrackingSolver()),
+           ("ac3", lambda: BacktrackingSolver(arcconsistency="ac3")),
+           ("ac2001", lambda: BacktrackingSolver(arcconsistency="ac2001")),
+           ("incremental", lambda: BacktrackingSolver(incremental=True)),
+           ("trail", lambda: BacktrackingSolver(trail=True)),
+           ("incremental trail",
+            lambda: BacktrackingSolver(incremental=True, trail=True)),
+           ("luby restarts",
+            lambda: BacktrackingSolver(restarts="luby", seed=0)),
+           ("geometric restarts",
+            lambda: BacktrackingSolver(restarts="geometric", seed=0)),
+           ("dom/wdeg", lambda: BacktrackingSolver(weighteddegree=True)),
+           ("dom/wdeg restarts",
+            lambda: BacktrackingSolver(weighteddegree=True, restarts="luby",
+                                       seed=0)),
+           ("lcv", lambda: BacktrackingSolver(valueorder="lcv")),
+           ("backjumping", lambda: BackjumpingSolver())]
+
+def main(names=None):
+    for problemname, makeproblem, all in PROBLEMS:
+        print problemname
+        for solvername, makesolver in SOLVERS:
+            if names and solvername not in names:
+                continue
+            counter = Counter()
+            problem = makeproblem(counter)
+            problem.setSolver(makesolver())
+            start = time.time()
+            if all:
+                solutions = len(problem.getSolutions())
+            else:
+                solutions = int(problem.getSolution() is not None)
+            runtime = time.time()-start
+            print "  %-20s %4d solution(s) %10d checks %8d nodes " \
+                  "%8.0f nodes/s %8.3fs" % \
+                  (solvername, solutions, counter.checks, counter.nodes,
+                   counter.nodes/max(runtime, 1e-6), runtime),
+            if counter.filters:
+                print "%8d pruned" % sum([constraint.pruned for constraint
+                                          in counter.filters]),
+            print
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
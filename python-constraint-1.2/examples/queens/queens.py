@@ -5,8 +5,12 @@
 from constraint import *
 import sys
 
-def main(show=False):
-    problem = Problem()
+def main(show=False, parallel=False):
+    if parallel:
+        # The columns are split over one process per CPU.
+        problem = Problem(ParallelSolver())
+    else:
+        problem = Problem()
     size = 8
     cols = range(size)
     rows = range(size)
@@ -23,6 +27,22 @@ def main(show=False):
         for solution in solutions:
             showSolution(solution, size)
 
+def minConflicts(size, show=False):
+    # The conflicts of all queens are counted with arrays, instead of a
+    # function per pair of queens. The solver is called directly with one
+    # row array shared by all queens, since a Problem would need a domain
+    # list per queen, which doesn't fit in memory for large sizes.
+    import numpy
+    rows = numpy.arange(size)
+    solver = VectorMinConflictsSolver()
+    solution = solver.solve([rows]*size, [(rows, rows, (0, 1, -1))])
+    if solution is None:
+        print "No solution found"
+    else:
+        print "Found a solution!"
+        if show:
+            showSolution(solution, size)
+
 def showSolution(solution, size):
     sys.stdout.write("   %s \n" % ("-"*((size*4)-1)))
     for i in range(size):
@@ -38,10 +58,17 @@ def showSolution(solution, size):
     sys.stdout.write("   %s \n" % ("-"*((size*4)-1)))
 
 if __name__ == "__main__":
-    show = False
-    if len(sys.argv) == 2 and sys.argv[1] == "-s":
-        show = True
-    elif len(sys.argv) != 1:
-        sys.exit("Usage: queens.py [-s]")
-    main(show)
+    args = sys.argv[1:]
+    show = "-s" in args
+    if show:
+        args.remove("-s")
+    parallel = "-p" in args
+    if parallel:
+        args.remove("-p")
+    if len(args) == 2 and args[0] == "-m" and args[1].isdigit():
+        minConflicts(int(args[1]), show)
+    elif not args:
+        main(show, parallel)
+    else:
+        sys.exit("Usage: queens.py [-s] [-p] [-m SIZE]")
 
@@ -18,9 +18,13 @@ def main(show=False):
             if col1 < col2:
                 problem.addConstraint(lambda row1, row2: row1 != row2,
                                       (col1, col2))
-    solutions = problem.getSolutions()
-    print "Found %d solution(s)!" % len(solutions)
-    assert len(solutions) == factorial(size)
+    if show:
+        solutions = problem.getSolutions()
+        count = len(solutions)
+    else:
+        count = problem.getSolutionCount()
+    print "Found %d solution(s)!" % count
+    assert count == factorial(size)
     if show:
         for solution in solutions:
             showSolution(solution, size)
@@ -4,19 +4,27 @@
 # for a crashcourse on creating a CSP-solver in a weekend, see http://www.cs.northwestern.edu/~ian/GDCConstraintsHowTo.pdf
 
 from constraintproblem import *
+from exactcover import DLXSolver
 import sys
+import time
 from pprint import pprint
 import os
 import csv
 from random import shuffle
 from datetime import datetime
 from collections import OrderedDict
+from multiprocessing import Pool
+from itertools import izip, islice
 
 CHECK_X_SUDOKUS = 100
 SUDOKUS = []
 SUDOKUS_LINES = []
 SUDOKU_SIZE = (9, 9)
 N_SUDOKUS = 0
+# Topology per sudoku size, see sudoku_topology
+TOPOLOGIES = {}
+# Line written by solve_batches for a sudoku without a solution
+NO_SOLUTION = "no solution"
 
 class Sudoku(object):
 
@@ -69,6 +77,20 @@ class Sudoku(object):
         variance = float(d) / n
         return variance
 
+def parse_sudoku(line):
+    """ parses one line of a sudoku file to a 2dimensional array, empty cells ('.' or '0') become 0 """
+    line = line.replace(".","0")
+    sudoku = []
+    row = []
+    for character in line:
+        if character.isdigit():
+            row.append(int(character))
+        # Go to next row when all columns are read    
+        if (len(row) == SUDOKU_SIZE[1]):
+            sudoku.append(row)
+            row = []
+    return sudoku
+
 def read_sudokus(filename):
     """import all sudoku's from file given by user"""
 
@@ -76,22 +98,20 @@ def read_sudokus(filename):
         with open(filename,'r') as f:
             # For each sudoku in the file
             for line in f:
-                line = line.replace(".","0")
-                sudoku = []
-                row = []
-                for character in line:
-                    if character.isdigit():
-                        row.append(int(character))
-                    # Go to next row when all columns are read    
-                    if (len(row) == SUDOKU_SIZE[1]):
-                        sudoku.append(row)
-                        row = []
-                sud = Sudoku(sudoku)
+                sud = Sudoku(parse_sudoku(line))
                 SUDOKUS.append(sud)
             f.close()
     except IOError as e:
         print "I/O error({0}): {1}".format(e.errno, e.strerror)
 
+def iter_sudokus(filename, start=0):
+    """ generator over the sudokus in the file given by user, one line at a time.
+        the first start lines are skipped, so we can resume a run that stopped halfway.
+    """
+    with open(filename,'r') as f:
+        for line in islice(f, start, None):
+            yield parse_sudoku(line)
+
 def variable_domains(problem,sudoku):
     """ Add variables with domain 1-9 for each variable
     we have to somehow translate all the sudokuchars to constraints. i.e. if (1,1) = 1 at init, there needs to be a constraint over variable (1,1) so that its domain is only [1]. 
@@ -127,6 +147,17 @@ def sudoku_constraints(problem):
     problem.addConstraint(1,[(7,7),(7,8),(7,9),(8,7),(8,8),(8,9),(9,7),(9,8),(9,9)])
     return problem
 
+def sudoku_topology():
+    """ returns the Topology with the standard sudoku constraints for the current SUDOKU_SIZE.
+        it is made once per size and then shared by all sudokus, so for every sudoku we only add its variables.
+    """
+    if SUDOKU_SIZE not in TOPOLOGIES:
+        problem = Problem()
+        problem = variable_domains(problem, [[0] * SUDOKU_SIZE[1]] * SUDOKU_SIZE[0])
+        problem = sudoku_constraints(problem)
+        TOPOLOGIES[SUDOKU_SIZE] = Topology(problem.variables, problem.constraints)
+    return TOPOLOGIES[SUDOKU_SIZE]
+
 def rewrite2array(solution):
     """ rewrites an solution of the form  {(1,1): [4], (1,2): [5] , .... (9,9) : [1]} to an 2dimensional array.
         this is useful if we want to output it in a human readable form.
@@ -161,7 +192,21 @@ def output_data(outputfile, output):
                 f.write("\n")
 
 
-def print_statistics(forward_checking = False, minimal_remaining_values = False):
+def count_solutions(outputfile):
+    """ returns the number of solutions that are completely written to outputfile.
+        a last line that was only partly written (for example because the program crashed) is removed from the file.
+    """
+    n = 0
+    end = 0
+    with open(outputfile, 'r+b') as f:
+        for line in f:
+            if line.endswith("\n"):
+                n += 1
+                end += len(line)
+        f.truncate(end)
+    return n
+
+def print_statistics(forward_checking = False, minimal_remaining_values = False, weighted_degree = False):
     os.chdir("statistics/")
 
     dt = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
@@ -171,6 +216,8 @@ def print_statistics(forward_checking = False, minimal_remaining_values = False)
         filename += "fc-"
     if minimal_remaining_values:
         filename += "mrv-"
+    if weighted_degree:
+        filename += "wdeg-"
     filename += str(dt) + ".csv"
 
     with open(filename, 'wb') as csvfile:
@@ -186,13 +233,17 @@ def print_statistics(forward_checking = False, minimal_remaining_values = False)
             avg_splits += sudoku_obj.splits 
         avg_backtracks = avg_backtracks/N_SUDOKUS
         avg_splits = avg_splits/N_SUDOKUS
-        spamwriter.writerow(['Heuristics:', 'forward_checking = ' + str(forward_checking), 'minimal_remaining_values = ' + str(minimal_remaining_values)])
+        # the heuristics mostly change the hard sudokus, so the spread of the backtracks is shown too
+        backtracks = sorted(sudoku_obj.backtracks for sudoku_obj in SUDOKUS if sudoku_obj.solved)
+        spamwriter.writerow(['Heuristics:', 'forward_checking = ' + str(forward_checking), 'minimal_remaining_values = ' + str(minimal_remaining_values), 'weighted_degree = ' + str(weighted_degree)])
 
         spamwriter.writerow(['--------------------------'])
         spamwriter.writerow(['Number of sudokus', N_SUDOKUS])
         spamwriter.writerow(['total runtime', round(runtime,3)])
         spamwriter.writerow(['average backtracks:', avg_backtracks])
         spamwriter.writerow(['average splits:', avg_splits])
+        spamwriter.writerow(['median backtracks:', backtracks[len(backtracks) // 2]])
+        spamwriter.writerow(['maximum backtracks:', backtracks[-1]])
         spamwriter.writerow(['--------------------------'])
 
         # NOW CALCULATE statistics for givens
@@ -268,7 +319,130 @@ def print_statistics(forward_checking = False, minimal_remaining_values = False)
         spamwriter.writerow(['--------------------------'])
     os.chdir("../")
 
-def main(arg, forward_checking = False, minimal_remaining_values=False):
+def solve_sudoku(job):
+    """ solves a single sudoku, job is a tuple (sudoku, options) where options are the keyword arguments for Problem.
+        returns the solution as 2dimensional array and the statistics of the solver.
+        this is a module level function, so it can be used by the worker processes of main.
+    """
+    sudoku, options = job
+    # the standard sudoku constraints are the same for every sudoku, so they are shared
+    problem = Problem(topology=sudoku_topology(), **options)
+
+    problem = variable_domains(problem,sudoku)
+    # Get solution (this is of the form {(1,1): [4], (1,2): [5] , .... (9,9) : [1]})
+    solution, statistics = problem.getSolution()
+    return rewrite2array(solution), statistics
+
+def imap_bounded(pool, func, iterable, chunksize):
+    """ like pool.imap, but takes at most chunksize items at a time from iterable.
+        pool.imap itself reads the whole iterable ahead, which does not fit in memory for very large files.
+    """
+    iterable = iter(iterable)
+    while True:
+        jobs = list(islice(iterable, chunksize))
+        if not jobs:
+            return
+        for result in pool.imap(func, jobs):
+            yield result
+
+def stream_solutions(inputfile, outputfile, start=0, workers=1, options={}):
+    """ solves the sudokus in inputfile one by one and writes every solution directly to outputfile.
+        unlike main, not all sudokus and solutions are kept in memory, so the size of the file does not matter.
+        the first start sudokus are skipped and their solutions are expected to be in outputfile already, the new
+        solutions are appended. without outputfile the solutions are written to the screen.
+        options are the keyword arguments for Problem, see solve_sudoku.
+        returns the total statistics of all solved sudokus.
+    """
+    n_sudokus = 0
+    runtime = 0
+    backtracks = 0
+    splits = 0
+    jobs = ((sudoku, options) for sudoku in iter_sudokus(inputfile, start))
+    if workers > 1:
+        pool = Pool(workers)
+        results = imap_bounded(pool, solve_sudoku, jobs, workers * 64)
+    else:
+        pool = None
+        results = (solve_sudoku(job) for job in jobs)
+
+    if outputfile:
+        f = open(outputfile, 'a' if start else 'w')
+    else:
+        f = sys.stdout
+    try:
+        for solution_array, statistics in results:
+            f.write(rewrite2output(solution_array))
+            f.write("\n")
+            f.flush()
+            n_sudokus += 1
+            runtime += statistics.runtime
+            backtracks += statistics.backtracks
+            splits += statistics.splits
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return n_sudokus, Statistics(runtime = runtime, backtracks = backtracks, splits = splits)
+
+def solve_batches(inputfile, outputfile, options={}, batchsize=10000):
+    """ solves the sudokus in inputfile in batches of batchsize sudokus, with the numpy BatchSolver.
+        every batch is propagated at once, only the sudokus that are not solved by that are solved one by one with
+        a Problem with the given options. the solutions are written to outputfile, or to the screen. for a sudoku
+        without a solution the line NO_SOLUTION is written, so the lines still match the lines of inputfile.
+        returns the number of sudokus, the number solved by propagation only, the number without a solution and
+        the runtime.
+    """
+    # numpy is only needed here, so it is imported here
+    from batchsolver import BatchSolver
+
+    start = time.time()
+    variables = [(row + 1, col + 1) for row in range(SUDOKU_SIZE[0]) for col in range(SUDOKU_SIZE[1])]
+    solver = BatchSolver(sudoku_topology(), variables, range(1, SUDOKU_SIZE[1] + 1))
+    n_sudokus = 0
+    n_propagated = 0
+    n_unsolved = 0
+    sudokus = iter_sudokus(inputfile)
+    f = open(outputfile, 'w') if outputfile else sys.stdout
+    try:
+        while True:
+            batch = list(islice(sudokus, batchsize))
+            if not batch:
+                break
+            # one row with all cells per sudoku, in the order of variables
+            givens = [[digit for row in sudoku for digit in row] for sudoku in batch]
+            solutions, propagated = solver.solve(solver.from_givens(givens), options)
+            for solution in solutions:
+                if solution:
+                    f.write(rewrite2output(rewrite2array(solution)))
+                else:
+                    # contradicting givens, or no solution found by the search
+                    f.write(NO_SOLUTION)
+                    n_unsolved += 1
+                f.write("\n")
+            n_sudokus += len(batch)
+            n_propagated += propagated
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return n_sudokus, n_propagated, n_unsolved, time.time() - start
+
+def pop_option(arg, option, flag=False):
+    """ removes option from the command line arguments arg.
+        returns the value after the option (True for a flag), or None if the option is not given.
+    """
+    if option not in arg:
+        return None
+    i = arg.index(option)
+    if flag:
+        del arg[i]
+        return True
+    value = arg[i + 1]
+    del arg[i:i + 2]
+    return value
+
+def main(arg, forward_checking = False, minimal_remaining_values=False, domain_backend="list", trail=False, propagation=None, engine="csp"):
     global N_SUDOKUS
     N_SUDOKUS = 0
     print_to_file = False
@@ -276,6 +450,41 @@ def main(arg, forward_checking = False, minimal_remaining_values=False):
     forward_checking = True
     minimal_remaining_values = True
 
+    # Options can be given anywhere on the command line
+    arg = list(arg)
+    # Number of worker processes
+    workers = int(pop_option(arg, "--workers") or 1)
+    # Solve and write the sudokus one at a time, optionally starting at a line offset
+    stream = pop_option(arg, "--stream", flag=True)
+    resume = pop_option(arg, "--resume", flag=True)
+    start = int(pop_option(arg, "--start") or 0)
+    # Propagate all sudokus at once with numpy
+    batch = pop_option(arg, "--batch", flag=True)
+    # Solver engine: "csp" for the backtracking solvers, "dlx" for the exact cover solver
+    engine = pop_option(arg, "--engine") or engine
+    # Start the search over after a growing number of backtracks: "luby" or "geometric"
+    restarts = pop_option(arg, "--restarts")
+    # Choose the next variable by domain size divided by weighted degree
+    weighted_degree = pop_option(arg, "--wdeg", flag=True) or False
+    # Order of the values of a cell: "lcv" or "frequency"
+    value_ordering = pop_option(arg, "--values")
+    if value_ordering == "lcv":
+        # lcv is only allowed with the trail search
+        trail = True
+
+    # keyword arguments for every Problem
+    options = dict(forward_checking=forward_checking, minimal_remaining_values=minimal_remaining_values,
+                   domain_backend=domain_backend, trail=trail, propagation=propagation, restarts=restarts,
+                   weighted_degree=weighted_degree, value_ordering=value_ordering)
+    if engine == "dlx":
+        options["solver"] = DLXSolver()
+    elif engine != "csp":
+        raise ValueError("Unknown engine %s" % repr(engine))
+    elif value_ordering == "frequency":
+        # one solver for all sudokus, so it knows the solutions of the sudokus before. worker processes get a new
+        # copy of the solver with every sudoku, so with --workers it learns nothing.
+        options["solver"] = Problem(**options).solver
+
     # User input size sudoku
     if len(arg) > 3:
         size = arg[3].split('x')
@@ -284,6 +493,24 @@ def main(arg, forward_checking = False, minimal_remaining_values=False):
     if len(arg) > 2 and arg[2][-4:] == ".txt":
         print_to_file = True
         outputfile = arg[2]
+    if resume and not outputfile:
+        raise ValueError("--resume needs an output file to continue")
+
+    if batch:
+        N_SUDOKUS, propagated, unsolved, runtime = solve_batches(arg[1], outputfile, options)
+        print "solved " + str(N_SUDOKUS - unsolved) + " of " + str(N_SUDOKUS) + " sudokus in " + str(round(runtime, 3)) + " seconds, " + str(round(N_SUDOKUS / runtime, 1)) + " sudokus/second"
+        print str(propagated) + " sudokus were solved by propagation only"
+        if unsolved:
+            print str(unsolved) + " sudokus have no solution, their lines are \"" + NO_SOLUTION + "\""
+        return
+
+    if stream:
+        if resume and os.path.exists(outputfile):
+            start = count_solutions(outputfile)
+        N_SUDOKUS, statistics = stream_solutions(arg[1], outputfile, start, workers, options)
+        print "solved " + str(N_SUDOKUS) + " sudokus, starting at sudoku " + str(start + 1)
+        print statistics
+        return
 
     # Read sudokus from text file
     read_sudokus(arg[1])
@@ -292,20 +519,20 @@ def main(arg, forward_checking = False, minimal_remaining_values=False):
     output = []
     output_stats = []
     shuffle(SUDOKUS)
-    for sudoku_obj in SUDOKUS[:CHECK_X_SUDOKUS]:
+    sudoku_objs = SUDOKUS[:CHECK_X_SUDOKUS]
+    jobs = ((sudoku_obj.sudoku, options) for sudoku_obj in sudoku_objs)
+    if workers > 1:
+        # every sudoku is solved in a worker process, imap gives the results back in the order of the sudokus
+        pool = Pool(workers)
+        results = pool.imap(solve_sudoku, jobs)
+    else:
+        pool = None
+        results = (solve_sudoku(job) for job in jobs)
+    for sudoku_obj, (solution_array, statistics) in izip(sudoku_objs, results):
         N_SUDOKUS += 1
         print "solving sudoku " + str(N_SUDOKUS)
-        sudoku = sudoku_obj.sudoku
-        problem = Problem(forward_checking=forward_checking, minimal_remaining_values=minimal_remaining_values)
-
-        problem = variable_domains(problem,sudoku)
-        # Add standard sudoku constraints
-        problem = sudoku_constraints(problem)
-        # Get solution (this is of the form {(1,1): [4], (1,2): [5] , .... (9,9) : [1]})
-        solution, statistics = problem.getSolution()
         sudoku_obj.solved = True
         print statistics
-        solution_array = rewrite2array(solution)
         if not print_to_file:
             pprint(solution_array)
         else:
@@ -313,10 +540,13 @@ def main(arg, forward_checking = False, minimal_remaining_values=False):
         sudoku_obj.runtime = getattr(statistics,'runtime')
         sudoku_obj.backtracks = getattr(statistics,'backtracks')
         sudoku_obj.splits = getattr(statistics,'splits')
+    if pool is not None:
+        pool.close()
+        pool.join()
     #if an outputfile is specified
     if outputfile:
         output_data(outputfile, output)
-    print_statistics(forward_checking, minimal_remaining_values)
+    print_statistics(forward_checking, minimal_remaining_values, weighted_degree)
 
 if __name__ == '__main__':
     if len(sys.argv) == 1:
@@ -324,6 +554,15 @@ if __name__ == '__main__':
         print "If no size given, than default sudoku size is 9x9"
         print "if no outputfile is given, the solutions will be outputted on the screen"
         print "Example: python sudoku.py \"input.txt\" \"output.txt\" "
+        print "Use --workers N to solve the sudokus with N processes"
+        print "Use --stream to write every solution as soon as it is found, --start N to skip the first N sudokus"
+        print "and --resume to continue after the last solution in the outputfile"
+        print "Use --engine dlx to solve the sudokus as exact cover problem instead of with backtracking"
+        print "Use --restarts luby or --restarts geometric to start the search over after a growing number of backtracks"
+        print "Use --wdeg to choose the next cell by domain size divided by weighted degree (dom/wdeg)"
+        print "Use --values lcv or --values frequency to try the least constraining or the most frequent values first,"
+        print "lcv uses the trail search"
+        print "Use --batch to propagate all sudokus at once with numpy, and only search the ones that are not solved then"
     else:
         main(sys.argv,forward_checking=True, minimal_remaining_values=True)
         #main(sys.argv,forward_checking=True, minimal_remaining_values=False)